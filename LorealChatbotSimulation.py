@@ -1,34 +1,50 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import time
+import json
+import os
 import re
 
-# Function to simulate typing effect with pauses after punctuation
-def type_message(role, message, speed=0.06):
-    typed_message = ""
-    message_placeholder = st.empty()
+# 'client' sends the whole demo to the browser once and animates it there, so a viewer costs the server one
+# script run; 'server' replays it from this script with a re-render per character, as the demo originally did
+RENDER_MODE = os.environ.get('CHATBOT_RENDER_MODE', 'client')
+
+PUNCTUATION = [".", ",", "!", "?", ":", ";"]
+PUNCTUATION_PAUSE = 0.5
+MESSAGE_PAUSE = 3
+TITLE_SPEED = 0.1
 
-    # Replacing specific words with HTML styled versions
-    formatted_message = re.sub(r'\b(TADA|TAD-AI|STANDA|STAND-AI|VALORIZ-AI)\b',
-                               r'<span style="color:red;"><strong>\1</strong></span>',
-                               message)
+# Replacing specific words with HTML styled versions
+def highlight(message):
+    return re.sub(r'\b(TADA|TAD-AI|STANDA|STAND-AI|VALORIZ-AI)\b',
+                  r'<span style="color:red;"><strong>\1</strong></span>',
+                  message)
 
+# Split a formatted message into the pieces typed one at a time, each with the pause that follows it.
+# Highlighted spans are typed as a whole so the markup is never cut in half.
+def typing_steps(formatted_message, speed):
+    steps = []
     i = 0
     while i < len(formatted_message):
         if formatted_message[i:i+6] == '<span ':
             end_span = formatted_message.find('</span>', i) + 7
             segment = formatted_message[i:end_span]
-            typed_message += segment
             i = end_span
         else:
-            typed_message += formatted_message[i]
+            segment = formatted_message[i]
             i += 1
+        # Pause longer for punctuation, otherwise type at the passed speed
+        steps.append((segment, PUNCTUATION_PAUSE if formatted_message[i-1] in PUNCTUATION else speed))
+    return steps
 
+# Function to simulate typing effect with pauses after punctuation
+def type_message(role, message, speed=0.06):
+    typed_message = ""
+    message_placeholder = st.empty()
+    for segment, pause in typing_steps(highlight(message), speed):
+        typed_message += segment
         message_placeholder.markdown(f"**{role}:** {typed_message}", unsafe_allow_html=True)
-
-        if formatted_message[i-1] in [".", ",", "!", "?", ":", ";"]:
-            time.sleep(0.5)  # Pause longer for punctuation
-        else:
-            time.sleep(speed)  # Typing speed based on the passed parameter
+        time.sleep(pause)
 
 # Function to display loading animation
 def loading_animation():
@@ -46,7 +62,7 @@ def type_title(title):
     for char in title:
         typed_title += char
         title_placeholder.markdown(f"<h1 style='color:white;'>{typed_title}</h1>", unsafe_allow_html=True)
-        time.sleep(0.1)  # Adjust the speed of typing here
+        time.sleep(TITLE_SPEED)  # Adjust the speed of typing here
 
 # Function to display a black screen
 def black_screen(duration):
@@ -88,21 +104,99 @@ conversation = [
     ("Shaun", "Right, let's do this!"),
 ]
 
-# Initial black screen before starting everything
-black_screen(2)
+# Typing speed of each message; a couple of lines are typed slower or faster for effect
+def message_speed(role, message):
+    if (role, message) == ("L’Oréal GPT", "Excellent point, Shaun. We're seeing men become increasingly interested in skincare, haircare, and even makeup. The opportunities there are substantial."):
+        return 0.07
+    if (role, message) == ("L’Oréal GPT", "Indeed it will be. Now, are you going to actually present something or are we going to spend the rest of the day chatting?"):
+        return 0.045
+    return 0.06
+
+# Browser-side player: the same black screen, title, loading animation and typed conversation,
+# driven by timers in the page instead of the script thread
+CLIENT_PLAYER = """
+<style>
+    body { margin: 0; background-color: rgb(14, 17, 23); color: rgb(250, 250, 250);
+           font-family: "Source Sans Pro", sans-serif; font-size: 16px; line-height: 1.6; }
+    h1 { color: white; }
+    .loading { font-size: 24px; color: white; font-weight: bold; }
+</style>
+<div id="demo"></div>
+<script>
+const demo = __DEMO__;
+const root = document.getElementById('demo');
+const sleep = seconds => new Promise(resolve => setTimeout(resolve, seconds * 1000));
+const follow = () => window.scrollTo(0, document.body.scrollHeight);
 
-# Type the title
-type_title("L’Oréal GPT")
+async function play() {
+    await sleep(demo.blackScreen);
 
-# Initial delay with loading animation before starting the conversation
-loading_animation()
+    const title = document.createElement('h1');
+    root.appendChild(title);
+    for (const char of demo.title) {
+        title.textContent += char;
+        await sleep(demo.titleSpeed);
+    }
 
-# Display the conversation with delay and typing effect
-for role, message in conversation:
-    if (role, message) == ("L’Oréal GPT", "Excellent point, Shaun. We're seeing men become increasingly interested in skincare, haircare, and even makeup. The opportunities there are substantial."):
-        type_message(role, message, speed=0.07)
-    elif (role, message) == ("L’Oréal GPT", "Indeed it will be. Now, are you going to actually present something or are we going to spend the rest of the day chatting?"):
-        type_message(role, message, speed=0.045)
+    const loading = document.createElement('div');
+    loading.className = 'loading';
+    root.appendChild(loading);
+    for (let repeat = 0; repeat < 3; repeat++) {
+        for (let dots = 0; dots < 4; dots++) {
+            loading.textContent = 'Loading' + '.'.repeat(dots);
+            await sleep(0.5);
+        }
+    }
+    loading.remove();
+
+    for (const message of demo.messages) {
+        const line = document.createElement('p');
+        root.appendChild(line);
+        let typed = '';
+        for (const [segment, pause] of message.steps) {
+            typed += segment;
+            line.innerHTML = '<strong>' + message.role + ':</strong> ' + typed;
+            follow();
+            await sleep(pause);
+        }
+        await sleep(demo.messagePause);
+    }
+}
+play();
+</script>
+"""
+
+# Render the whole demo in one component; the browser plays it without further messages from the server
+def play_in_browser(title, conversation, height=900):
+    demo = {
+        'blackScreen': 2,
+        'title': title,
+        'titleSpeed': TITLE_SPEED,
+        'messagePause': MESSAGE_PAUSE,
+        'messages': [{'role': role, 'steps': typing_steps(highlight(message), message_speed(role, message))}
+                     for role, message in conversation]
+    }
+    # Escape '</' so message markup cannot close the script element early
+    payload = json.dumps(demo, ensure_ascii=False).replace('</', '<\\/')
+    player = CLIENT_PLAYER.replace('__DEMO__', payload)
+    if hasattr(st, 'iframe'):
+        st.iframe(player, height=height)
     else:
-        type_message(role, message)
-    time.sleep(3)
+        components.html(player, height=height, scrolling=True)
+
+if RENDER_MODE == 'client':
+    play_in_browser("L’Oréal GPT", conversation)
+else:
+    # Initial black screen before starting everything
+    black_screen(2)
+
+    # Type the title
+    type_title("L’Oréal GPT")
+
+    # Initial delay with loading animation before starting the conversation
+    loading_animation()
+
+    # Display the conversation with delay and typing effect
+    for role, message in conversation:
+        type_message(role, message, speed=message_speed(role, message))
+        time.sleep(MESSAGE_PAUSE)
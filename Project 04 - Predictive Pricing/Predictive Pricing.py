@@ -1,13 +1,28 @@
 import pandas as pd
 from sklearn.model_selection import TimeSeriesSplit, RandomizedSearchCV
-from sklearn.preprocessing import OneHotEncoder, TargetEncoder
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingRandomSearchCV
+from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, TargetEncoder
 from sklearn.metrics import mean_squared_error, r2_score
-from sklearn.ensemble import GradientBoostingRegressor
+from sklearn.ensemble import GradientBoostingRegressor, HistGradientBoostingRegressor
+from sklearn.compose import ColumnTransformer
+from sklearn.impute import SimpleImputer
+from sklearn.pipeline import Pipeline, make_pipeline
+from sklearn.base import clone
 import statistics
 import numpy as np
 import os
+import sys
+import argparse
+import shutil
+import tempfile
+import hashlib
+import json
 import logging
 import yaml
+import joblib
+from datetime import datetime
+from pricing_model import load_model_artifact, score_batch
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,21 +40,196 @@ def load_config():
         logging.error(f"Error parsing YAML file: {exc}")
         raise
 
+# Source files with their CSV separators
+DATA_FILES = {
+    'Customer': ('Customer_anonymized2.csv', ','),
+    'SalesRegion': ('SalesRegion_anonymized2.csv', ','),
+    'SalesStructure': ('SalesStructure_anonymized2.csv', ','),
+    'CustomerImportance': ('CustomerImportance.csv', ';'),
+    'BisnodeScore': ('BisnodeScore.csv', ';'),
+    'BusinessTree': ('BusinessTree.csv', ';'),
+    'OrderHeader': ('OrderHeader_anonymized.csv', ','),
+    'OrderItem': ('OrderItem_anonymized.csv', ',')
+}
+DIMENSION_TABLES = ['Customer', 'SalesRegion', 'SalesStructure', 'CustomerImportance', 'BisnodeScore', 'BusinessTree']
+
+# Explicit CSV column types. Ids with gaps are float32 so they join with each other without casts,
+# comma-decimal numbers are read as strings for convert_types, and repeated labels are categorical.
+DATA_DTYPES = {
+    'Customer': {'CustomerId': 'category', 'SalesDistrictId': 'float32', 'BisnodeScore': 'float32', 'CustomerImportanceId': 'float32',
+                 'CustomerName1': 'str', 'CustomerBranch': 'category'},
+    'SalesRegion': {'SalesRegionId': 'float32', 'SalesRegionName': 'category', 'ResponsibleEmployee': 'category'},
+    'SalesStructure': {'SalesDistrictId': 'float32', 'SalesRegionId': 'float32', 'SalesDistrictName': 'category', 'SalesRepresentativeName': 'category'},
+    'CustomerImportance': {'ImportanceId': 'float32', 'Importance': 'category'},
+    'BisnodeScore': {'BisnodeScore': 'float32', 'BisnodeScoreName': 'category', 'BisnodeScoreDescription': 'category'},
+    'BusinessTree': {'BusinessTreeId': 'int32', 'BusinessYearEnd': 'int16', 'BusinessTreeFatherId': 'int32'},
+    'OrderHeader': {'CustomerId': 'category', 'Created': 'str', 'OrderValueLocalCurrency': 'str',
+                    'OrderTotalDiscountLocalCurrency': 'str', 'OrderTotalChargeLocalCurrency': 'str'},
+    'OrderItem': {'Created': 'category', 'ItemCount': 'str', 'ItemLPriceLocalCurrency': 'str',
+                  'ItemSalesPriceLocalCurrency': 'str', 'ItemChargeLocalCurrency': 'str',
+                  'Discount': 'str', 'SystemDiscount': 'str'}
+}
+
+# Columns kept in float64: epoch seconds and the order totals compared in the order-value filter
+FLOAT64_COLUMNS = ['CreatedOrderHeader', 'OrderValueLocalCurrency', 'OrderTotalDiscountLocalCurrency', 'OrderTotalChargeLocalCurrency']
+
+# Read a source CSV with its separator and column types
+def read_source(name, base_dir, **kwargs):
+    file, sep = DATA_FILES[name]
+    return pd.read_csv(os.path.join(base_dir, file), sep=sep, dtype=DATA_DTYPES.get(name), **kwargs)
+
+# Memory a frame would take with the types read_csv infers without DATA_DTYPES:
+# 64-bit numbers and plain strings instead of categories
+def default_memory_usage(df):
+    total = df.index.memory_usage(deep=True)
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(series.cat.categories.dtype)
+        if pd.api.types.is_float_dtype(series):
+            series = series.astype('float64')
+        elif pd.api.types.is_integer_dtype(series):
+            series = series.astype('int64')
+        total += series.memory_usage(index=False, deep=True)
+    return total
+
+# Downcast numbers and dictionary-encode repeated strings in columns the CSV types left open
+def optimize_dtypes(df, report_name=None):
+    before = default_memory_usage(df) if report_name else 0
+    for col in df.columns:
+        if col in FLOAT64_COLUMNS:
+            continue
+        if pd.api.types.is_float_dtype(df[col]):
+            df[col] = df[col].astype('float32')
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+        elif (pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col])) and df[col].nunique() < len(df) // 2:
+            df[col] = df[col].astype('category')
+    if report_name:
+        after = df.memory_usage(deep=True).sum()
+        logging.info(f"{report_name}: {before / 2**20:.1f} MB with default types -> {after / 2**20:.1f} MB after dtype optimization")
+    return df
+
+# Bump whenever convert_types changes so stale cache entries are rebuilt
+CACHE_VERSION = 5
+
+# Resolve the BusinessTree parent links into an ancestor index. Nodes are addressed by their
+# position within the (BusinessYearEnd, BusinessTreeId) table, and each pass moves every node
+# one level up at once, so the whole tree is resolved in as many vectorized steps as it is deep.
+# Adds BusinessTreeDepth (0 for roots) and BusinessTreeLevel<L>Id, the node's ancestor at level L
+# counted from the root, for every level above the node. Nodes that are their own father are
+# roots; the nodes of any other parent cycle are logged and treated as roots too.
+def build_business_tree_index(business_tree):
+    nodes = pd.MultiIndex.from_arrays([business_tree['BusinessYearEnd'], business_tree['BusinessTreeId']])
+    parent = nodes.get_indexer(pd.MultiIndex.from_arrays([business_tree['BusinessYearEnd'], business_tree['BusinessTreeFatherId']]))
+    parent[parent == np.arange(len(parent))] = -1
+
+    # Jumping 2^k >= len(parent) levels up leaves only nodes in or below a cycle on a node, and that node lies on the cycle
+    jump = parent.copy()
+    for _ in range(max(len(parent), 1).bit_length()):
+        jump = np.where(jump >= 0, jump[jump], -1)
+    cyclic = np.unique(jump[jump >= 0])
+    if len(cyclic):
+        logging.warning(f"BusinessTree: {len(cyclic)} nodes with cyclic parent links are treated as roots, "
+                        f"e.g. BusinessTreeId {business_tree['BusinessTreeId'].iloc[cyclic[:5]].tolist()}")
+        parent[cyclic] = -1
+
+    # ancestors[k] holds the position of each node's (k + 1)-th ancestor, or -1 above the root
+    ancestors = []
+    current = parent
+    while (current >= 0).any():
+        ancestors.append(current)
+        current = np.where(current >= 0, parent[current], -1)
+    ancestors = np.array(ancestors, dtype=np.int64).reshape(len(ancestors), len(parent))
+    depth = (ancestors >= 0).sum(axis=0)
+
+    ids = business_tree['BusinessTreeId'].to_numpy(dtype=float)
+    levels = {}
+    for level in range(len(ancestors)):
+        steps_up = depth - level
+        valid = steps_up >= 1
+        position = ancestors[np.where(valid, steps_up - 1, 0), np.arange(len(parent))]
+        levels[f'BusinessTreeLevel{level}Id'] = np.where(valid, ids[position], np.nan)
+    return pd.concat([business_tree, pd.DataFrame({'BusinessTreeDepth': depth, **levels}, index=business_tree.index)], axis=1)
+
+# Order creation timestamps as epoch seconds, whatever resolution pandas parses them to
+def created_seconds(created):
+    created = pd.to_datetime(created)
+    return (created - pd.Timestamp(0, tz=created.dt.tz)) / pd.Timedelta(seconds=1)
+
+# Convert raw CSV columns to their final types
+def convert_types(name, df, report=False, optimize=True):
+    if name == 'OrderHeader':
+        df = df.rename(columns={"Discount": "DiscountOrderHeader", "Created": "CreatedOrderHeader"})
+        for col in ['OrderValueLocalCurrency', 'OrderTotalDiscountLocalCurrency', 'OrderTotalChargeLocalCurrency']:
+            df[col] = df[col].str.replace(',', '.').astype(float)
+        df['CreatedOrderHeader'] = created_seconds(df['CreatedOrderHeader'])
+    elif name == 'OrderItem':
+        df = df.rename(columns={"Discount": "DiscountOrderItem", "Created": "CreatedOrderItem"})
+        for col in ['ItemCount', 'ItemLPriceLocalCurrency', 'ItemSalesPriceLocalCurrency', 'ItemChargeLocalCurrency', 'DiscountOrderItem', 'SystemDiscount']:
+            df[col] = df[col].str.replace(',', '.').astype(float)
+    elif name == 'BusinessTree':
+        df = build_business_tree_index(df)
+    return optimize_dtypes(df, name if report else None) if optimize else df
+
+# Hash a file's contents in blocks
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Read a single table, going through the Parquet cache when one is configured
+def load_table(name, base_dir, cache_dir=None):
+    file, sep = DATA_FILES[name]
+    path = os.path.join(base_dir, file)
+    if cache_dir is None:
+        return convert_types(name, read_source(name, base_dir), report=True)
+
+    cache_file = os.path.join(cache_dir, f'{name}.parquet')
+    meta_file = os.path.join(cache_dir, f'{name}.json')
+    stat = os.stat(path)
+    meta = {}
+    if os.path.exists(cache_file) and os.path.exists(meta_file):
+        with open(meta_file, 'r') as file:
+            meta = json.load(file)
+
+    digest = None
+    if meta.get('version') == CACHE_VERSION:
+        if meta['mtime_ns'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+            logging.info(f"Loading {name} from cache")
+            return pd.read_parquet(cache_file)
+        # Touched but possibly unchanged file: compare contents before reparsing
+        digest = file_hash(path)
+        if digest == meta['sha256']:
+            meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            with open(meta_file, 'w') as file:
+                json.dump(meta, file)
+            logging.info(f"Loading {name} from cache")
+            return pd.read_parquet(cache_file)
+
+    logging.info(f"Parsing {file} and refreshing cache")
+    df = convert_types(name, read_source(name, base_dir), report=True)
+    df.to_parquet(cache_file, index=False)
+    meta = {'version': CACHE_VERSION, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+            'sha256': digest or file_hash(path)}
+    with open(meta_file, 'w') as file:
+        json.dump(meta, file)
+    return df
+
 # Load datasets
-def load_data(base_dir):
+def load_data(base_dir, cache_dir=None):
     try:
-        data_files = {
-            'Customer': 'Customer_anonymized2.csv',
-            'SalesRegion': 'SalesRegion_anonymized2.csv',
-            'SalesStructure': 'SalesStructure_anonymized2.csv',
-            'CustomerImportance': 'CustomerImportance.csv',
-            'BisnodeScore': 'BisnodeScore.csv',
-            'BusinessTree': 'BusinessTree.csv',
-            'OrderHeader': 'OrderHeader_anonymized.csv',
-            'OrderItem': 'OrderItem_anonymized.csv'
-        }
-        data = {name: pd.read_csv(os.path.join(base_dir, file), sep=';' if 'Importance' in file or 'Score' in file or 'Tree' in file else ',') 
-                for name, file in data_files.items()}
+        if cache_dir is not None:
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                logging.warning("pyarrow is not installed, loading data without the Parquet cache.")
+                cache_dir = None
+            else:
+                os.makedirs(cache_dir, exist_ok=True)
+        data = {name: load_table(name, base_dir, cache_dir) for name in DATA_FILES}
         return data
     except FileNotFoundError as e:
         logging.error(f"File not found: {e.filename}")
@@ -48,134 +238,352 @@ def load_data(base_dir):
         logging.error(f"Error loading data: {e}")
         raise
 
-# Preprocess data
-def preprocess_data(data):
-    # Rename columns for clarity
-    data['OrderHeader'] = data['OrderHeader'].rename(columns={"Discount": "DiscountOrderHeader", "Created": "CreatedOrderHeader"})
-    data['OrderItem'] = data['OrderItem'].rename(columns={"Discount": "DiscountOrderItem", "Created": "CreatedOrderItem"})
-    
-    # Convert numeric columns from string to float
-    for col in ['OrderValueLocalCurrency', 'OrderTotalDiscountLocalCurrency', 'OrderTotalChargeLocalCurrency']:
-        data['OrderHeader'][col] = data['OrderHeader'][col].str.replace(',', '.').astype(float)
-    data['OrderHeader']['CreatedOrderHeader'] = pd.to_datetime(data['OrderHeader']['CreatedOrderHeader']).astype('int64') / 10**9
-    
-    for col in ['ItemCount', 'ItemLPriceLocalCurrency', 'ItemSalesPriceLocalCurrency', 'ItemChargeLocalCurrency', 'DiscountOrderItem', 'SystemDiscount']:
-        data['OrderItem'][col] = data['OrderItem'][col].str.replace(',', '.').astype(float)
-    
-    # Merge datasets
+# Join the customer-level dimension tables
+def build_customer_dimension(data):
     df_merge = pd.merge(data['SalesStructure'], data['SalesRegion'], how='left', on='SalesRegionId')
     df_merge = pd.merge(data['Customer'], df_merge, how='left', on='SalesDistrictId')
     df_merge = pd.merge(df_merge, data['CustomerImportance'], how='left', left_on='CustomerImportanceId', right_on='ImportanceId')
     df_merge = pd.merge(df_merge, data['BisnodeScore'], how='left', on='BisnodeScore')
-    df_merge = pd.merge(data['OrderHeader'], df_merge, how='inner', on='CustomerId')
-    df_merge = pd.merge(data['OrderItem'], df_merge, how='inner', on='OrderId')
-    df_merge = pd.merge(df_merge, data['BusinessTree'], how='left', left_on=['PckBusinessTreeId', 'BusinessYearEnd'], right_on=['BusinessTreeId', 'BusinessYearEnd'])
-    
-    # Clean data
+    return df_merge
+
+# Columns not used for modelling
+DROP_COLUMNS = [
+    'EEOChargeLocalCurrency', 'CustomerName1', 'SalesDistrictName', 'SalesRegionName', 'OrderTotalDiscountLocalCurrency', 
+    'ItemSalesPriceLocalCurrency', 'BusinessTreeId', 'CustomerId', 'CustomerImportanceId', 'BisnodeScoreName', 
+    'BisnodeScoreDescription', 'OrderId', 'ItemPosition', 'CreatedOrderItem', 'OrderValueLocalCurrency', 
+    'DiscountOrderHeader', 'OrderTotalChargeLocalCurrency', 'ResponsibleEmployee', 'SalesRepresentativeName', 
+    'SystemDiscount', 'ImportanceId'
+]
+
+# Join order headers to the customer dimension and keep only valid orders
+def prepare_order_header(order_header, customer_dim):
+    # Share the customer dictionary so the join runs on category codes; unknown customers would be dropped by the inner join anyway
+    order_header = order_header.assign(CustomerId=order_header['CustomerId'].astype(customer_dim['CustomerId'].dtype))
+    df_merge = pd.merge(order_header, customer_dim, how='inner', on='CustomerId')
+    df_merge = df_merge[~((df_merge['OrderValueLocalCurrency'] - df_merge['OrderTotalDiscountLocalCurrency'] - df_merge['OrderTotalChargeLocalCurrency']) < 0)]
+    # Header-level columns are dropped here so they are not repeated for every order item
+    return df_merge.drop(columns=[col for col in DROP_COLUMNS if col in df_merge.columns and col != 'OrderId'])
+
+# Join order items to the prepared headers and the business tree
+def merge_order_items(order_item, order_header, business_tree):
+    df_merge = pd.merge(order_item, order_header, how='inner', on='OrderId')
+    df_merge = pd.merge(df_merge, business_tree, how='left', left_on=['PckBusinessTreeId', 'BusinessYearEnd'], right_on=['BusinessTreeId', 'BusinessYearEnd'])
+    return df_merge
+
+# Column types of the cleaned dataset. They do not depend on the values of a chunk, so the Parquet parts
+# written chunk by chunk share one schema. Ids and years may be missing in the order exports, so they are
+# float32 like the BusinessTreeLevel<L>Id columns.
+CLEAN_DTYPES = {
+    'PckBusinessTreeId': 'float32', 'ItemCount': 'float32', 'ItemLPriceLocalCurrency': 'float32', 'ItemChargeLocalCurrency': 'float32',
+    'DiscountOrderItem': 'float32', 'CreatedOrderHeader': 'float64', 'BusinessYearEnd': 'float32', 'SalesDistrictId': 'float32',
+    'BisnodeScore': 'float32', 'CustomerBranch': 'category', 'SalesRegionId': 'float32', 'Importance': 'category',
+    'BusinessTreeFatherId': 'float32', 'BusinessTreeDepth': 'float32'
+}
+
+# Cast a cleaned frame to the fixed column types
+def apply_clean_dtypes(df):
+    return df.astype({col: CLEAN_DTYPES.get(col, 'float32') for col in df.columns
+                      if col in CLEAN_DTYPES or col.startswith('BusinessTreeLevel')})
+
+# Clean merged data
+def clean_data(df_merge):
     df_clean = df_merge.dropna(subset=['OrderId'])
-    df_clean = df_clean.drop(df_clean[(df_clean['OrderValueLocalCurrency'] - df_clean['OrderTotalDiscountLocalCurrency'] - df_clean['OrderTotalChargeLocalCurrency']) < 0].index)
     df_clean = df_clean.dropna(subset=['DiscountOrderItem'])
     
     # Drop unnecessary columns
-    drop_columns = [
-        'EEOChargeLocalCurrency', 'CustomerName1', 'SalesDistrictName', 'SalesRegionName', 'OrderTotalDiscountLocalCurrency', 
-        'ItemSalesPriceLocalCurrency', 'BusinessTreeId', 'CustomerId', 'CustomerImportanceId', 'BisnodeScoreName', 
-        'BisnodeScoreDescription', 'OrderId', 'ItemPosition', 'CreatedOrderItem', 'OrderValueLocalCurrency', 
-        'DiscountOrderHeader', 'OrderTotalChargeLocalCurrency', 'ResponsibleEmployee', 'SalesRepresentativeName', 
-        'SystemDiscount', 'ImportanceId'
-    ]
-    df_clean = df_clean.drop(drop_columns, axis=1)
+    df_clean = df_clean.drop(columns=[col for col in DROP_COLUMNS if col in df_clean.columns])
     
     # Fill NaN values with 0
     df_clean['ItemCount'] = df_clean['ItemCount'].fillna(0)
     df_clean['ItemChargeLocalCurrency'] = df_clean['ItemChargeLocalCurrency'].fillna(0)
     
-    return df_clean
-
-# Prepare data without data leak
-def data_prep_without_data_leak(X_df, y_df):
-    columns_to_fill = ['SalesRegionId', 'CustomerBranch', 'Importance', 'SalesDistrictId', 'BisnodeScore']
-    for column in columns_to_fill:
-        X_df.loc[:, column] = X_df[column].fillna(X_df[column].mode()[0])
-
-    columns_to_encode = ['SalesRegionId', 'CustomerBranch', 'Importance']
-    one_hot_encoder = OneHotEncoder(drop='first', sparse_output=False, handle_unknown='ignore')
-    X_train_encoded = one_hot_encoder.fit_transform(X_df[columns_to_encode])
-    X_train_encoded_df = pd.DataFrame(X_train_encoded, columns=one_hot_encoder.get_feature_names_out(columns_to_encode))
-    X_df = X_df.drop(columns=columns_to_encode, axis=1)
-    X_df.reset_index(inplace=True)
-    X_df = pd.concat([X_df, X_train_encoded_df], axis=1)
-
-    columns_to_target_encode = ['SalesDistrictId']
-    target_encoder = TargetEncoder()
-    X_target_encoded = target_encoder.fit_transform(X_df[columns_to_target_encode], y_df)
-    X_target_encoded_df = pd.DataFrame(X_target_encoded, columns=target_encoder.get_feature_names_out(columns_to_target_encode))
-    X_df = X_df.drop(columns=columns_to_target_encode, axis=1)
-    X_df = pd.concat([X_df, X_target_encoded_df], axis=1)
-
-    return X_df
+    return apply_clean_dtypes(df_clean)
 
-# Train and evaluate model
-def train_evaluate_model(X_train_val, y_train_val, tscv, param_dist):
-    model = GradientBoostingRegressor()
-    random_search = RandomizedSearchCV(estimator=model, param_distributions=param_dist, n_iter=50, cv=tscv, verbose=2, n_jobs=-1, random_state=42)
-    X_train_prepped = data_prep_without_data_leak(X_train_val, y_train_val)
-    random_search.fit(X_train_prepped, y_train_val)
-
-    best_model = random_search.best_estimator_
-    logging.info(f'Best model found: {best_model}')
-    
-    mse_collection = []
-    r2_collection = []
+# Preprocess data
+def preprocess_data(data):
+    customer_dim = build_customer_dimension(data)
+    order_header = prepare_order_header(data['OrderHeader'], customer_dim)
+    df_merge = merge_order_items(data['OrderItem'], order_header, data['BusinessTree'])
+    return clean_data(df_merge)
 
-    for train_index, validation_index in tscv.split(X_train_val):
-        X_train, X_val = X_train_val.iloc[train_index, :], X_train_val.iloc[validation_index, :]
-        y_train, y_val = y_train_val.iloc[train_index], y_train_val.iloc[validation_index]
+# Stream an order export as converted chunks. keep selects the raw rows worth converting,
+# so rows that are dropped anyway never go through the conversions. Chunks keep their read
+# types rather than being downcast on their own values; clean_data fixes the final types.
+def iter_orders(name, base_dir, chunk_size, keep=None):
+    with read_source(name, base_dir, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            if keep is not None:
+                chunk = chunk[keep(chunk)]
+            if not chunk.empty:
+                yield convert_types(name, chunk, optimize=False)
 
-        X_train = data_prep_without_data_leak(X_train, y_train)
-        X_val = data_prep_without_data_leak(X_val, y_val)
+# Stream orders created after the last watermark into the persisted cleaned dataset.
+# Headers are joined to the customer dimension and reduced to their modelling columns
+# first; order items are then processed chunk by chunk against that broadcast table,
+# so peak memory is bounded by the chunk size and the compact header table.
+def update_clean_dataset(config, rebuild=False):
+    base_dir = config['data_directory']
+    cache_dir = config.get('cache_directory')
+    dataset_dir = config['clean_dataset_directory']
+    chunk_size = config.get('chunk_size', 500000)
+    os.makedirs(dataset_dir, exist_ok=True)
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
 
-        X_train = X_train.reindex(sorted(X_train.columns), axis=1)
-        X_val = X_val.reindex(sorted(X_val.columns), axis=1)
+    dimensions = {name: load_table(name, base_dir, cache_dir) for name in DIMENSION_TABLES}
+    customer_dim = build_customer_dimension(dimensions)
+    tree_levels = [col for col in dimensions['BusinessTree'].columns if col.startswith('BusinessTreeLevel')]
 
-        best_model.fit(X_train, y_train)
-        
-        y_pred = best_model.predict(X_val)
+    state_file = os.path.join(dataset_dir, '_watermark.json')
+    state = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'r') as file:
+            state = json.load(file)
+    # Watermarks without a unit were derived from the datetime resolution of the pandas that wrote them
+    if state and state.get('unit') != 'seconds' and not rebuild:
+        logging.warning(f"Watermark in {dataset_dir} is not in epoch seconds, rebuilding the cleaned dataset")
+        rebuild = True
+    # Parts have one BusinessTreeLevel<L>Id column per tree level, so all of them are rewritten when the depth changes
+    if state and state.get('business_tree_levels') != tree_levels and not rebuild:
+        logging.warning(f"BusinessTree depth changed to {len(tree_levels)} levels, rebuilding the cleaned dataset")
+        rebuild = True
+    if rebuild:
+        for file in os.listdir(dataset_dir):
+            if file.startswith('part-') or file == '_watermark.json':
+                os.remove(os.path.join(dataset_dir, file))
+        state = {}
+    watermark = state.get('CreatedOrderHeader', float('-inf'))
+
+    header_chunks = []
+    new_watermark = watermark
+    for chunk in iter_orders('OrderHeader', base_dir, chunk_size, keep=lambda raw: created_seconds(raw['Created']) > watermark):
+        new_watermark = max(new_watermark, float(chunk['CreatedOrderHeader'].max()))
+        header_chunks.append(prepare_order_header(chunk, customer_dim))
+    if new_watermark == watermark:
+        logging.info(f"No orders newer than watermark {watermark}")
+        return
+    order_header = pd.concat(header_chunks, ignore_index=True)
+
+    # Write the parts before moving the watermark so a failed run is simply repeated.
+    # Part names carry the run's start time, so runs never write over each other's parts.
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S%f')
+    row_count = 0
+    new_orders = order_header['OrderId'].unique()
+    for i, chunk in enumerate(iter_orders('OrderItem', base_dir, chunk_size, keep=lambda raw: raw['OrderId'].isin(new_orders))):
+        df_part = clean_data(merge_order_items(chunk, order_header, dimensions['BusinessTree']))
+        if not df_part.empty:
+            part_file = os.path.join(dataset_dir, f'part-{run_id}-{i:05d}.parquet')
+            if os.path.exists(part_file):
+                raise FileExistsError(f"Refusing to overwrite {part_file}")
+            df_part.to_parquet(part_file, index=False)
+            row_count += len(df_part)
+    with open(state_file, 'w') as file:
+        json.dump({'CreatedOrderHeader': new_watermark, 'unit': 'seconds', 'business_tree_levels': tree_levels}, file)
+    logging.info(f"Appended {row_count} rows from {len(order_header)} new orders to {dataset_dir}")
+
+# Load the persisted cleaned dataset
+def load_clean_dataset(dataset_dir):
+    return apply_clean_dtypes(pd.read_parquet(dataset_dir))
+
+# Feature groups used by the encoder
+ONE_HOT_COLUMNS = ['SalesRegionId', 'CustomerBranch', 'Importance']
+TARGET_ENCODED_COLUMNS = ['SalesDistrictId']
+MODE_FILLED_COLUMNS = ['BisnodeScore']
+
+# Build the feature encoder; as a pipeline step it is refitted on each training fold only, so nothing leaks from validation data
+def build_feature_encoder():
+    return ColumnTransformer([
+        ('one_hot', make_pipeline(SimpleImputer(strategy='most_frequent'), OneHotEncoder(drop='first', sparse_output=False, handle_unknown='ignore')), ONE_HOT_COLUMNS),
+        ('target', make_pipeline(SimpleImputer(strategy='most_frequent'), TargetEncoder()), TARGET_ENCODED_COLUMNS),
+        ('mode', SimpleImputer(strategy='most_frequent'), MODE_FILLED_COLUMNS)
+    ], remainder=SimpleImputer(strategy='median'), sparse_threshold=0)
+
+# Build the feature encoder for histogram gradient boosting, which handles categories and missing values natively.
+# The ordinal-encoded categorical columns come first so the model can address them by position.
+def build_hist_feature_encoder():
+    return ColumnTransformer([
+        ('ordinal', OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=np.nan), ONE_HOT_COLUMNS),
+        ('target', make_pipeline(SimpleImputer(strategy='most_frequent'), TargetEncoder()), TARGET_ENCODED_COLUMNS)
+    ], remainder='passthrough', sparse_threshold=0)
+
+# Model backends: (model factory, feature encoder factory, parameter setting the number of trees)
+MODEL_BACKENDS = {
+    'gbr': (GradientBoostingRegressor, build_feature_encoder, 'n_estimators'),
+    'hist': (lambda: HistGradientBoostingRegressor(categorical_features=list(range(len(ONE_HOT_COLUMNS)))), build_hist_feature_encoder, 'max_iter')
+}
+
+# Chain the feature encoder and the model; with memory set, fitted encoders are cached per fold
+def build_model_pipeline(backend='gbr', memory=None):
+    model_factory, encoder_factory, _ = MODEL_BACKENDS[backend]
+    return Pipeline([('features', encoder_factory()), ('model', model_factory())], memory=memory)
+
+# Build the hyperparameter search described by the search section of config.yml
+def build_search(pipeline, param_dist, tscv, search_config, n_trees_param='n_estimators', n_jobs=-1):
+    param_dist = {f'model__{name}': values for name, values in param_dist.items()}
+    n_iter_no_change = search_config.get('n_iter_no_change')
+    if n_iter_no_change:
+        # Early stopping picks the number of trees within a single fit, and that fit passes
+        # through every smaller tree count on the way, so only the largest is tried
+        pipeline.set_params(model__n_iter_no_change=n_iter_no_change,
+                            model__validation_fraction=search_config.get('validation_fraction', 0.1))
+        if 'early_stopping' in pipeline.named_steps['model'].get_params():
+            pipeline.set_params(model__early_stopping=True)
+        param_dist[f'model__{n_trees_param}'] = [max(param_dist[f'model__{n_trees_param}'])]
+
+    strategy = search_config.get('strategy', 'random')
+    n_iter = search_config.get('n_iter', 50)
+    if strategy == 'random':
+        return RandomizedSearchCV(estimator=pipeline, param_distributions=param_dist, n_iter=n_iter, cv=tscv, verbose=2, n_jobs=n_jobs, random_state=42)
+    if strategy == 'halving':
+        return HalvingRandomSearchCV(estimator=pipeline, param_distributions=param_dist, n_candidates=n_iter, factor=search_config.get('factor', 3),
+                                     min_resources=search_config.get('min_resources', 'exhaust'), cv=tscv, verbose=2, n_jobs=n_jobs, random_state=42)
+    raise ValueError(f"Unknown search strategy: {strategy}")
+
+# Fit a fresh copy of the model on one fold and score it on the fold's validation rows
+def evaluate_fold(model, data_file, train_index, validation_index):
+    X_train_val, y_train_val = joblib.load(data_file, mmap_mode='r')
+    X_train, X_val = X_train_val.iloc[train_index, :], X_train_val.iloc[validation_index, :]
+    y_train, y_val = y_train_val.iloc[train_index], y_train_val.iloc[validation_index]
+
+    model.fit(X_train, y_train)
+    y_pred = model.predict(X_val)
+    return mean_squared_error(y_val, y_pred), r2_score(y_val, y_pred)
+
+# Train and evaluate model
+def train_evaluate_model(X_train_val, y_train_val, tscv, param_dist, memory=None, search_config=None, backend='gbr'):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pipeline = build_model_pipeline(backend, memory or temp_dir)
+        # Histogram boosting is multithreaded itself, so candidates run one at a time instead of competing for cores
+        n_jobs = 1 if backend == 'hist' else -1
+        random_search = build_search(pipeline, param_dist, tscv, search_config or {}, MODEL_BACKENDS[backend][2], n_jobs)
+        random_search.fit(X_train_val, y_train_val)
+
+        best_model = random_search.best_estimator_
+        logging.info(f'Best model found: {best_model.named_steps["model"]}')
         
-        mse = mean_squared_error(y_val, y_pred)
-        r2 = r2_score(y_val, y_pred)
-        logging.info(f'Mean Squared Error: {mse}')
-        logging.info(f'R-squared: {r2}')
-        mse_collection.append(mse)
-        r2_collection.append(r2)
+        # Folds are fitted concurrently, one worker per fold; the workers memory-map the training data from a
+        # single file and receive only row indices. Histogram boosting threads are divided among the workers.
+        data_file = os.path.join(temp_dir, 'train_val.joblib')
+        joblib.dump((X_train_val, y_train_val), data_file)
+        scores = joblib.Parallel(n_jobs=min(tscv.get_n_splits(), joblib.cpu_count()))(
+            joblib.delayed(evaluate_fold)(clone(best_model), data_file, train_index, validation_index)
+            for train_index, validation_index in tscv.split(X_train_val))
+
+        mse_collection = []
+        r2_collection = []
+        for mse, r2 in scores:
+            logging.info(f'Mean Squared Error: {mse}')
+            logging.info(f'R-squared: {r2}')
+            mse_collection.append(mse)
+            r2_collection.append(r2)
+
+        logging.info(f'Average Mean Squared Error: {statistics.mean(mse_collection)}')
+        logging.info(f'Average R-squared: {statistics.mean(r2_collection)}')
+
+        # Detach the cache so the returned model outlives the temporary directory
+        best_model.set_params(memory=None)
+    return best_model
+
+# Columns offered as choices in the Discount Calculator, and columns derived from another input there
+ARTIFACT_OPTION_COLUMNS = ['SalesDistrictId', 'CustomerBranch', 'Importance', 'BisnodeScore', 'PckBusinessTreeId']
+ARTIFACT_LOOKUPS = {'SalesDistrictId': lambda col: col == 'SalesRegionId', 'PckBusinessTreeId': lambda col: col.startswith('BusinessTree')}
+
+# Save the fitted pipeline as a versioned artifact together with what is needed to score single items
+def save_model_artifact(model, X, model_dir):
+    version = datetime.now().strftime('%Y%m%d%H%M%S')
+    defaults = {}
+    for col in X.columns:
+        if pd.api.types.is_numeric_dtype(X[col]):
+            defaults[col] = X[col].median()
+        else:
+            defaults[col] = X[col].mode().iloc[0]
+    artifact = {
+        'version': version,
+        'model': model,
+        'features': list(X.columns),
+        'defaults': defaults,
+        'options': {col: sorted(X[col].dropna().unique().tolist()) for col in ARTIFACT_OPTION_COLUMNS},
+        'lookups': {key: {target: X.dropna(subset=[key, target]).groupby(key)[target].first().to_dict()
+                          for target in X.columns if is_target(target)}
+                    for key, is_target in ARTIFACT_LOOKUPS.items()}
+    }
+    os.makedirs(model_dir, exist_ok=True)
+    path = os.path.join(model_dir, f'discount_model_{version}.joblib')
+    joblib.dump(artifact, path)
+    # Swap the latest artifact in with a rename so readers never see a partly written file
+    fd, temp_path = tempfile.mkstemp(dir=model_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, os.path.join(model_dir, 'discount_model_latest.joblib'))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    logging.info(f"Saved model artifact {path}")
+    return path
 
-    logging.info(f'Average Mean Squared Error: {statistics.mean(mse_collection)}')
-    logging.info(f'Average R-squared: {statistics.mean(r2_collection)}')
+# Read line items from a CSV or Excel file
+def read_items(path):
+    if path.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+# Headless batch scoring of a quote or price list
+def score_main(argv=None):
+    parser = argparse.ArgumentParser(prog='Predictive Pricing.py score', description='Score quote or price list line items with the trained discount model.')
+    parser.add_argument('input', help='CSV or Excel file with one line item per row, columns named like the model features')
+    parser.add_argument('output', help='CSV or Excel file to write the scored line items to')
+    parser.add_argument('--model', help='model artifact to use (default: latest artifact in model_directory)')
+    args = parser.parse_args(argv)
+    try:
+        model_path = args.model or os.path.join(load_config()['model_directory'], 'discount_model_latest.joblib')
+        artifact = load_model_artifact(model_path)
+        scored = score_batch(artifact, read_items(args.input))
+        if args.output.endswith('.xlsx'):
+            scored.to_excel(args.output, index=False)
+        else:
+            scored.to_csv(args.output, index=False)
+        logging.info(f"Scored {len(scored)} line items with model version {artifact['version']} into {args.output}")
+    except Exception as e:
+        logging.error(f"An error occurred: {e}")
+        sys.exit(1)
+
+# Split data into train-test sets using TimeSeriesSplit
+def split_train_test(df_clean):
+    df_clean.set_index('CreatedOrderHeader', inplace=True)
+    df_clean.sort_index(inplace=True)
+    X = df_clean.drop(['DiscountOrderItem'], axis=1)
+    y = df_clean['DiscountOrderItem']
+
+    tscv2splits = TimeSeriesSplit(n_splits=2)
+    for train_val_index, test_index in tscv2splits.split(X):
+        X_train_val, X_test = X.iloc[train_val_index, :], X.iloc[test_index, :]
+        y_train_val, y_test = y.iloc[train_val_index], y.iloc[test_index]
+    return X_train_val, X_test, y_train_val, y_test
 
 # Main function
 def main():
     try:
         config = load_config()
-        base_dir = config['data_directory']
-        data = load_data(base_dir)
-        df_clean = preprocess_data(data)
-        
-        # Split data into train-test sets using TimeSeriesSplit
-        df_clean.set_index('CreatedOrderHeader', inplace=True)
-        df_clean.sort_index(inplace=True)
-        X = df_clean.drop(['DiscountOrderItem'], axis=1)
-        y = df_clean['DiscountOrderItem']
-
-        tscv2splits = TimeSeriesSplit(n_splits=2)
-        for train_val_index, test_index in tscv2splits.split(X):
-            X_train_val, X_test = X.iloc[train_val_index, :], X.iloc[test_index, :]
-            y_train_val, y_test = y.iloc[train_val_index], y.iloc[test_index]
+        if config.get('incremental', False) or config.get('streaming', False):
+            update_clean_dataset(config, rebuild=not config.get('incremental', False))
+            df_clean = load_clean_dataset(config['clean_dataset_directory'])
+        else:
+            data = load_data(config['data_directory'], config.get('cache_directory'))
+            df_clean = preprocess_data(data)
+        logging.info(f"Cleaned dataset: {len(df_clean)} rows, {df_clean.memory_usage(deep=True).sum() / 2**20:.1f} MB")
+        X_train_val, X_test, y_train_val, y_test = split_train_test(df_clean)
 
         tscv = TimeSeriesSplit(n_splits=5)
-        param_dist = config['param_dist']
-        train_evaluate_model(X_train_val, y_train_val, tscv, param_dist)
+        backend = config.get('model_backend', 'gbr')
+        param_dist = config['param_dist'] if backend == 'gbr' else config[f'{backend}_param_dist']
+        best_model = train_evaluate_model(X_train_val, y_train_val, tscv, param_dist, config.get('feature_cache_directory'), config.get('search'), backend)
+        save_model_artifact(best_model, X_train_val, config['model_directory'])
     except Exception as e:
         logging.error(f"An error occurred: {e}")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'score':
+        score_main(sys.argv[2:])
+    else:
+        main()
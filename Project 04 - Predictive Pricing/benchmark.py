@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import importlib.util
+import logging
+import platform
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.model_selection import TimeSeriesSplit
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Load the pipeline script as a module; its file name is not importable directly
+def load_pipeline():
+    spec = importlib.util.spec_from_file_location('predictive_pricing', os.path.join(PROJECT_DIR, 'Predictive Pricing.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Format numbers the way the order exports store them: comma as the decimal separator
+def comma_decimals(values):
+    return pd.Series(np.round(values, 2)).astype(str).str.replace('.', ',', regex=False)
+
+# Write a synthetic copy of the source CSVs with scale times the base number of orders and customers.
+# Lookup tables are copied unchanged so every generated key still resolves in the joins.
+def generate_dataset(pp, out_dir, scale, base_orders=10000, items_per_order=3, source_dir=PROJECT_DIR, seed=42):
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    for name in ['SalesRegion', 'SalesStructure', 'CustomerImportance', 'BisnodeScore', 'BusinessTree']:
+        shutil.copyfile(os.path.join(source_dir, pp.DATA_FILES[name][0]), os.path.join(out_dir, pp.DATA_FILES[name][0]))
+
+    file, sep = pp.DATA_FILES['Customer']
+    customers = pd.read_csv(os.path.join(source_dir, file), sep=sep, dtype=str)
+    customers = pd.concat([customers.assign(CustomerId=customers['CustomerId'] + (f'-{copy}' if copy else ''))
+                           for copy in range(scale)], ignore_index=True)
+    customers.to_csv(os.path.join(out_dir, file), sep=sep, index=False)
+
+    business_tree = pd.read_csv(os.path.join(source_dir, pp.DATA_FILES['BusinessTree'][0]), sep=pp.DATA_FILES['BusinessTree'][1], encoding='utf-8-sig')
+    n_orders = base_orders * scale
+    order_header = pd.DataFrame({
+        'OrderId': np.arange(n_orders),
+        'CustomerId': rng.choice(customers['CustomerId'].to_numpy(), n_orders),
+        'Created': pd.date_range('2021-01-01', periods=n_orders, freq=pd.Timedelta(days=3 * 365) / n_orders).astype(str),
+        'OrderValueLocalCurrency': comma_decimals(rng.uniform(1000, 5000, n_orders)),
+        'OrderTotalDiscountLocalCurrency': comma_decimals(rng.uniform(0, 500, n_orders)),
+        'OrderTotalChargeLocalCurrency': comma_decimals(rng.uniform(0, 100, n_orders)),
+        'Discount': rng.uniform(0, 50, n_orders).round(1),
+        'BusinessYearEnd': rng.choice(business_tree['BusinessYearEnd'].unique(), n_orders)
+    })
+    file, sep = pp.DATA_FILES['OrderHeader']
+    order_header.to_csv(os.path.join(out_dir, file), sep=sep, index=False)
+
+    n_items = n_orders * items_per_order
+    order_ids = np.sort(rng.integers(0, n_orders, n_items))
+    order_item = pd.DataFrame({
+        'OrderId': order_ids,
+        'ItemPosition': pd.Series(order_ids).groupby(order_ids).cumcount().to_numpy() + 1,
+        'Created': order_header['Created'].to_numpy()[order_ids],
+        'PckBusinessTreeId': rng.choice(business_tree['BusinessTreeId'].to_numpy(), n_items),
+        'ItemCount': comma_decimals(rng.integers(1, 20, n_items).astype(float)),
+        'ItemLPriceLocalCurrency': comma_decimals(rng.uniform(10, 900, n_items)),
+        'ItemSalesPriceLocalCurrency': comma_decimals(rng.uniform(10, 900, n_items)),
+        'ItemChargeLocalCurrency': comma_decimals(rng.uniform(0, 9, n_items)),
+        'Discount': comma_decimals(rng.uniform(0, 60, n_items)),
+        'SystemDiscount': comma_decimals(rng.uniform(0, 60, n_items)),
+        'EEOChargeLocalCurrency': rng.uniform(0, 5, n_items).round(2)
+    })
+    file, sep = pp.DATA_FILES['OrderItem']
+    order_item.to_csv(os.path.join(out_dir, file), sep=sep, index=False)
+    return {'Customer': len(customers), 'OrderHeader': n_orders, 'OrderItem': n_items}
+
+# Resident memory of a process and its descendants from /proc, in bytes
+def proc_tree_rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as file:
+            total = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        children = []
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children', 'r') as file:
+                children.extend(file.read().split())
+    except OSError:
+        return 0
+    return total + sum(proc_tree_rss(child) for child in children)
+
+# Resident memory of this process and its worker processes (joblib, process pools), in bytes.
+# Uses psutil when installed, otherwise /proc where available.
+def current_rss():
+    if psutil is not None:
+        process = psutil.Process()
+        total = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+    if os.path.exists('/proc/self/statm'):
+        return proc_tree_rss(os.getpid())
+    return None
+
+# Process lifetime peaks of this process and of its finished child processes, in MB
+def max_rss():
+    if resource is None:
+        return None, None
+    unit = 2**20 if sys.platform == 'darwin' else 2**10
+    return (round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit, 1),
+            round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit, 1))
+
+# Samples resident memory in the background while a stage runs and keeps the highest value
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.02):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            rss = current_rss()
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return round(self.peak / 2**20, 1) if self.peak is not None else None
+
+# Times pipeline stages, samples their peak resident memory and writes one JSON line per stage.
+# tracemalloc can additionally report the peak of Python allocations in this process, at a cost in speed.
+class StageRecorder:
+    def __init__(self, output, run_id, trace_python=False):
+        self.output = output
+        self.run_id = run_id
+        self.trace_python = trace_python
+
+    def run(self, stage, scale, func, *args, **kwargs):
+        sampler = RssSampler()
+        sampler.start()
+        if self.trace_python:
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            peak_rss_mb = sampler.stop()
+        self_maxrss_mb, children_maxrss_mb = max_rss()
+        record = {'run': self.run_id, 'scale': scale, 'stage': stage, 'seconds': round(seconds, 4), 'peak_rss_mb': peak_rss_mb,
+                  'maxrss_mb': self_maxrss_mb, 'children_maxrss_mb': children_maxrss_mb}
+        if self.trace_python:
+            record['python_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+            tracemalloc.stop()
+        rows = result[0] if isinstance(result, tuple) else result
+        if isinstance(rows, (pd.DataFrame, pd.Series, np.ndarray)):
+            record['rows'] = len(rows)
+        elif isinstance(rows, dict):
+            record['tables'] = {name: table if isinstance(table, int) else len(table) for name, table in rows.items()}
+        print(json.dumps(record), file=self.output, flush=True)
+        logging.info(f"{stage} at {scale}x: {seconds:.2f} s, peak RSS {peak_rss_mb} MB")
+        return result
+
+# Run the pipeline stages on one generated dataset
+def benchmark_scale(pp, recorder, scale, work_dir, args):
+    data_dir = os.path.join(work_dir, f'data_{scale}x')
+    recorder.run('generate_dataset', scale, generate_dataset, pp, data_dir, scale, args.base_orders)
+    cache_dir = os.path.join(work_dir, f'cache_{scale}x') if args.cache else None
+    if cache_dir:
+        # First load fills the cache, the second one measures reading from it
+        recorder.run('load_data_cold', scale, pp.load_data, data_dir, cache_dir)
+    data = recorder.run('load_data', scale, pp.load_data, data_dir, cache_dir)
+    df_clean = recorder.run('preprocess_data', scale, pp.preprocess_data, data)
+    X_train_val, X_test, y_train_val, y_test = recorder.run('split_train_test', scale, pp.split_train_test, df_clean)
+    if 'train' in args.skip:
+        return
+
+    config = pp.load_config()
+    param_dist = config['param_dist'] if args.backend == 'gbr' else config[f'{args.backend}_param_dist']
+    search_config = dict(config.get('search') or {}, n_iter=args.n_iter)
+    features = pp.build_model_pipeline(args.backend).named_steps['features']
+    recorder.run('encode_features', scale, clone(features).fit_transform, X_train_val, y_train_val)
+    model = recorder.run('train_evaluate_model', scale, pp.train_evaluate_model, X_train_val, y_train_val,
+                         TimeSeriesSplit(n_splits=5), param_dist, None, search_config, args.backend)
+    if 'score' in args.skip:
+        return
+
+    model_dir = os.path.join(work_dir, f'models_{scale}x')
+    path = recorder.run('save_model_artifact', scale, pp.save_model_artifact, model, X_train_val, model_dir)
+    artifact = pp.load_model_artifact(path)
+    recorder.run('score_batch', scale, pp.score_batch, artifact, X_test.reset_index(drop=True))
+
+# Benchmark the pricing pipeline stages on synthetic data of increasing size
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the pricing pipeline stages on synthetic data and report them as JSON lines.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='dataset sizes as multiples of the base size (default: 1 10 100)')
+    parser.add_argument('--base-orders', type=int, default=10000, help='orders generated at scale 1 (default: 10000)')
+    parser.add_argument('--backend', default='hist', choices=['gbr', 'hist'], help='model backend to train (default: hist)')
+    parser.add_argument('--n-iter', type=int, default=5, help='search candidates, overriding config.yml (default: 5)')
+    parser.add_argument('--skip', nargs='*', default=[], choices=['train', 'score'], help='stages to leave out')
+    parser.add_argument('--cache', action='store_true', help='load through the Parquet cache')
+    parser.add_argument('--trace-python', action='store_true', help='also report the tracemalloc peak of Python allocations; slows pure-Python code down')
+    parser.add_argument('--output', help='append results to this file instead of printing them')
+    parser.add_argument('--work-dir', help='keep generated data and models here instead of a temporary directory')
+    args = parser.parse_args(argv)
+
+    pp = load_pipeline()
+    run_id = datetime.now().strftime('%Y%m%d%H%M%S')
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        recorder = StageRecorder(output, run_id, args.trace_python)
+        header = {'run': run_id, 'stage': 'environment', 'python': platform.python_version(), 'pandas': pd.__version__,
+                  'numpy': np.__version__, 'cpus': os.cpu_count(), 'backend': args.backend, 'base_orders': args.base_orders}
+        print(json.dumps(header), file=output, flush=True)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            work_dir = args.work_dir or temp_dir
+            for scale in args.scales:
+                benchmark_scale(pp, recorder, scale, work_dir, args)
+    finally:
+        if args.output:
+            output.close()
+
+if __name__ == '__main__':
+    main()
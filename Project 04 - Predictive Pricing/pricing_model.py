@@ -0,0 +1,19 @@
+import joblib
+
+# Load a model artifact written by save_model_artifact
+def load_model_artifact(path):
+    return joblib.load(path)
+
+# Score many line items in one vectorized call; feature columns missing from the input fall back to the artifact defaults
+def score_batch(artifact, items):
+    features = items.reindex(columns=artifact['features'])
+    for key, lookups in artifact['lookups'].items():
+        for target, mapping in lookups.items():
+            features[target] = features[target].fillna(features[key].map(mapping))
+    features = features.fillna(artifact['defaults'])
+
+    scored = items.copy()
+    scored['OptimalDiscount'] = artifact['model'].predict(features)
+    if 'ItemLPriceLocalCurrency' in scored.columns:
+        scored['DiscountedPrice'] = scored['ItemLPriceLocalCurrency'] * (1 - scored['OptimalDiscount'] / 100)
+    return scored
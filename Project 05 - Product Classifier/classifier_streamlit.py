@@ -1,23 +1,188 @@
 import streamlit as st
 import pandas as pd
-import pickle
+import os
+import hashlib
+import itertools
+from collections import deque
+from model_registry import MODEL_FILES, ModelRegistry, create_executor, classify_chunks
+from prediction_cache import PredictionCache
 from io import BytesIO
 from openpyxl.utils import get_column_letter
-from openpyxl import load_workbook
-
-# Load models
-with open('beauty_category.pk1', 'rb') as f:
-    loaded_model = pickle.load(f)
-with open('beauty_sub_category.pk1', 'rb') as f:
-    loaded_model_2 = pickle.load(f)
-with open('manufacturer.pk1', 'rb') as f:
-    loaded_model_3 = pickle.load(f)
-with open('manufacturer_brand.pk1', 'rb') as f:
-    loaded_model_4 = pickle.load(f)
-with open('manufacturer_sub-brand.pk1', 'rb') as f:
-    loaded_model_5 = pickle.load(f)
-with open('manufacturer_franchise.pk1', 'rb') as f:
-    loaded_model_6 = pickle.load(f)
+from openpyxl import Workbook, load_workbook
+
+# Directory with the .pk1 models
+MODEL_DIR = os.environ.get('PRODUCT_MODEL_DIR', '.')
+
+# Rows per classification chunk, and chunks in flight at once; uploads of a single chunk are classified in-process
+CHUNK_SIZE = 20000
+MAX_PENDING = 2 * (os.cpu_count() or 1)
+
+# Local cache of earlier predictions and the number of products it keeps
+CACHE_PATH = os.environ.get('PRODUCT_CACHE_PATH', 'prediction_cache.sqlite')
+CACHE_MAX_ENTRIES = 1000000
+
+# Load the model registry once per process; each head is loaded on first use.
+# The models' version is part of the cache key, so replacing a .pk1 file loads fresh models
+# and the registry of the previous version is released.
+@st.cache_resource(max_entries=1)
+def get_model_registry(model_version):
+    return ModelRegistry(MODEL_DIR)
+
+# Share one classification process pool across sessions and model versions; its workers reload
+# the models themselves when they are given a new version
+@st.cache_resource
+def get_executor():
+    return create_executor(MODEL_DIR)
+
+# Open the prediction cache once per process; opening it for a new model version purges stale entries
+# and releases the cache of the previous version
+@st.cache_resource(max_entries=1)
+def get_prediction_cache(model_version):
+    return PredictionCache(CACHE_PATH, model_version, list(MODEL_FILES), CACHE_MAX_ENTRIES)
+
+# Stream the rows of an Excel upload as DataFrame chunks instead of reading the whole workbook at once.
+# Rows and trailing header columns without any value, such as cells that only carry formatting, are
+# skipped. total['rows'] starts at the sheet's row count and drops with every skipped row, so it is
+# exact once all chunks have been read.
+def open_excel_chunks(file, chunk_size):
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    worksheet = workbook.active
+    rows = worksheet.iter_rows(values_only=True)
+    header = list(next(rows, ()))
+    while header and header[-1] is None:
+        header.pop()
+    total = {'rows': worksheet.max_row - 1 if worksheet.max_row else None}
+
+    def chunks():
+        chunk = []
+        emitted = False
+        for row in rows:
+            row = row[:len(header)]
+            if all(value is None for value in row):
+                if total['rows']:
+                    total['rows'] -= 1
+                continue
+            # Whole-number floats become ints, as pd.read_excel does
+            chunk.append([int(value) if isinstance(value, float) and value.is_integer() else value for value in row])
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                emitted = True
+                chunk = []
+        if chunk or not emitted:
+            yield pd.DataFrame(chunk, columns=header)
+        workbook.close()
+
+    return total, chunks()
+
+# Column widths for the export: longest value or header of each column plus padding
+def column_widths(df):
+    return [max(len(str(col)), int(df[col].astype(str).str.len().max()) if len(df) else 0) + 2 for col in df.columns]
+
+# Rows of the DataFrame as tuples with missing values as None, converted one batch at a time
+# so no object copy of the whole DataFrame is made
+def export_rows(df, batch_size=10000):
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size]
+        yield from batch.astype(object).where(batch.notna(), None).itertuples(index=False)
+
+# Exports kept per format, and how long an unused one is kept
+EXPORT_CACHE_ENTRIES = 8
+EXPORT_CACHE_TTL = '1h'
+
+# Convert the DataFrame to an Excel file in a single pass, streaming rows with constant memory.
+# xlsxwriter is used when installed, otherwise openpyxl in write-only mode. The exports are cached
+# on key, the hash of the upload and models, instead of hashing the DataFrame on every rerun.
+@st.cache_data(show_spinner=False, max_entries=EXPORT_CACHE_ENTRIES, ttl=EXPORT_CACHE_TTL)
+def to_excel(key, _df):
+    output = BytesIO()
+    widths = column_widths(_df)
+    rows = export_rows(_df)
+    try:
+        import xlsxwriter
+    except ImportError:
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet('Sheet1')
+        for i, width in enumerate(widths, start=1):
+            worksheet.column_dimensions[get_column_letter(i)].width = width
+        worksheet.append(list(_df.columns))
+        for row in rows:
+            worksheet.append(row)
+        workbook.save(output)
+    else:
+        workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+        worksheet = workbook.add_worksheet('Sheet1')
+        for i, width in enumerate(widths):
+            worksheet.set_column(i, i, width)
+        worksheet.write_row(0, 0, list(_df.columns))
+        for i, row in enumerate(rows, start=1):
+            worksheet.write_row(i, 0, row)
+        workbook.close()
+    return output.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=EXPORT_CACHE_ENTRIES, ttl=EXPORT_CACHE_TTL)
+def to_csv(key, _df):
+    return _df.to_csv(index=False).encode('utf-8')
+
+@st.cache_data(show_spinner=False, max_entries=EXPORT_CACHE_ENTRIES, ttl=EXPORT_CACHE_TTL)
+def to_parquet(key, _df):
+    return _df.to_parquet(index=False)
+
+# Download formats: export function and file name
+EXPORT_FORMATS = {
+    'Excel': (to_excel, 'New_Products_Classified.xlsx'),
+    'CSV': (to_csv, 'New_Products_Classified.csv'),
+    'Parquet': (to_parquet, 'New_Products_Classified.parquet')
+}
+
+# Classify an uploaded workbook; returns None when the required columns are missing
+def classify_upload(uploaded_file, model_version):
+    # Stream the Excel file in chunks
+    total, chunks = open_excel_chunks(uploaded_file, CHUNK_SIZE)
+    first_chunk = next(chunks, None)
+
+    # Ensure the necessary columns are present
+    if first_chunk is None or 'ProductNew' not in first_chunk.columns or 'EAN' not in first_chunk.columns:
+        return None
+
+    cache = get_prediction_cache(model_version)
+
+    # Previously classified products are taken from the cache; only the misses go to the models
+    cached_parts = deque()
+    def uncached_chunks():
+        for chunk in itertools.chain([first_chunk], chunks):
+            hits = cache.lookup(chunk)
+            cached_parts.append(hits)
+            yield chunk.drop(hits.index)
+
+    # Classify categories and manufacturer hierarchy, in parallel when the upload spans several chunks
+    if len(first_chunk) < CHUNK_SIZE:
+        registry = get_model_registry(model_version)
+        results = ((chunk, registry.predict_all(chunk['ProductNew'])) for chunk in uncached_chunks())
+    else:
+        results = classify_chunks(uncached_chunks(), get_executor(), MAX_PENDING, model_version=model_version)
+
+    progress = st.progress(0.0, text='Classifying products...')
+    classified = []
+    done = 0
+    for misses, predictions in results:
+        for head, values in predictions.items():
+            misses[head] = values
+        cache.store(misses)
+        chunk = pd.concat([cached_parts.popleft(), misses]).sort_index()
+        classified.append(chunk)
+        done += len(chunk)
+        if total['rows']:
+            progress.progress(min(done / total['rows'], 1.0), text=f"Classified {done} of {total['rows']} products")
+    progress.empty()
+    new_products = pd.concat(classified, ignore_index=True)
+
+    # Replace 'Not applicable' with blanks in ManufacturerFranchise where necessary
+    new_products['ManufacturerFranchise'] = new_products['ManufacturerFranchise'].replace('Not applicable', '')
+
+    # Convert EAN to string and remove commas
+    new_products['EAN'] = new_products['EAN'].astype(str).str.replace(',', '')
+
+    return new_products
 
 # Streamlit app
 st.title('Product Classifier')
@@ -33,62 +198,29 @@ st.markdown("""
 uploaded_file = st.file_uploader("Choose an Excel file", type="xlsx")
 
 if uploaded_file is not None:
-    # Read the Excel file
-    new_products = pd.read_excel(uploaded_file)
-
-    # Ensure the necessary columns are present
-    if 'ProductNew' in new_products.columns and 'EAN' in new_products.columns:
-        X_new = new_products['ProductNew']
-
-        # Classify categories and manufacturer hierarchy
-        new_products['Category'] = loaded_model.predict(X_new)
-        new_products['SubCategory'] = loaded_model_2.predict(X_new)
-        new_products['Manufacturer'] = loaded_model_3.predict(X_new)
-        new_products['ManufacturerBrand'] = loaded_model_4.predict(X_new)
-        new_products['ManufacturerSub-Brand'] = loaded_model_5.predict(X_new)
-        new_products['ManufacturerFranchise'] = loaded_model_6.predict(X_new)
-
-        # Replace 'Not applicable' with blanks in ManufacturerFranchise where necessary
-        new_products['ManufacturerFranchise'].replace('Not applicable', '', inplace=True)
-
-        # Convert EAN to string and remove commas
-        new_products['EAN'] = new_products['EAN'].apply(lambda x: str(x).replace(',', ''))
-
+    # Classify only when a different file or new models come in; reruns reuse the stored result
+    model_version = ModelRegistry(MODEL_DIR).version()
+    classified = st.session_state.get('classified')
+    if classified is None or classified['file_id'] != uploaded_file.file_id or classified['model_version'] != model_version:
+        upload_hash = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+        if classified is None or classified['upload_hash'] != upload_hash or classified['model_version'] != model_version:
+            classified = {'upload_hash': upload_hash, 'model_version': model_version,
+                          'products': classify_upload(uploaded_file, model_version)}
+        classified['file_id'] = uploaded_file.file_id
+        st.session_state['classified'] = classified
+    new_products = classified['products']
+
+    if new_products is not None:
         # Display the updated data with classification
         st.write('### Classified Products')
         st.dataframe(new_products)
 
-        # Convert the DataFrame to an Excel file in memory and adjust column widths
-        def to_excel(df):
-            output = BytesIO()
-            writer = pd.ExcelWriter(output, engine='openpyxl')
-            df.to_excel(writer, index=False, sheet_name='Sheet1')
-            writer.close()
-
-            # Adjust column widths
-            workbook = load_workbook(output)
-            worksheet = workbook.active
-
-            for col in worksheet.columns:
-                max_length = 0
-                column = col[0].column_letter
-                for cell in col:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = (max_length + 2)
-                worksheet.column_dimensions[column].width = adjusted_width
-
-            adjusted_output = BytesIO()
-            workbook.save(adjusted_output)
-            return adjusted_output.getvalue()
-
-        excel_data = to_excel(new_products)
+        # Offer the classified data for download in the chosen format
+        export_format = st.radio("Download format", list(EXPORT_FORMATS), horizontal=True)
+        export, file_name = EXPORT_FORMATS[export_format]
         st.download_button(label="Download Classified Data",
-                           data=excel_data,
-                           file_name='New_Products_Classified.xlsx')
+                           data=export(classified['upload_hash'] + classified['model_version'], new_products),
+                           file_name=file_name)
 
     else:
         st.error("The uploaded file does not contain the required 'ProductNew' and 'EAN' columns.")
@@ -0,0 +1,121 @@
+import os
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+from sklearn.pipeline import Pipeline
+
+# Classification heads: output column -> model file
+MODEL_FILES = {
+    'Category': 'beauty_category.pk1',
+    'SubCategory': 'beauty_sub_category.pk1',
+    'Manufacturer': 'manufacturer.pk1',
+    'ManufacturerBrand': 'manufacturer_brand.pk1',
+    'ManufacturerSub-Brand': 'manufacturer_sub-brand.pk1',
+    'ManufacturerFranchise': 'manufacturer_franchise.pk1'
+}
+
+# Keeps the classifier heads for the lifetime of the process, loading each one on first use
+class ModelRegistry:
+    def __init__(self, model_dir='.', mmap_mode='r'):
+        self.model_dir = model_dir
+        self.mmap_mode = mmap_mode
+        self._models = {}
+        self._splits = {}
+        self._lock = threading.Lock()
+
+    # Plain pickles load as before; files written with joblib.dump get their numpy arrays memory-mapped,
+    # so processes sharing the server also share the pages of large models
+    def _load(self, head):
+        return joblib.load(os.path.join(self.model_dir, MODEL_FILES[head]), mmap_mode=self.mmap_mode)
+
+    def get(self, head):
+        model = self._models.get(head)
+        if model is None:
+            with self._lock:
+                if head not in self._models:
+                    self._models[head] = self._load(head)
+                model = self._models[head]
+        return model
+
+    # Split a head into its text feature extraction, its final estimator and a fingerprint of the fitted
+    # feature extraction; heads with equal fingerprints produce identical feature matrices
+    def get_split(self, head):
+        split = self._splits.get(head)
+        if split is None:
+            model = self.get(head)
+            if isinstance(model, Pipeline) and len(model.steps) > 1:
+                featurizer = model[:-1]
+                split = (featurizer, model[-1], joblib.hash(featurizer))
+            else:
+                split = (None, model, None)
+            self._splits[head] = split
+        return split
+
+    # Fingerprint of the model files on disk; changes whenever any of them is replaced
+    def version(self):
+        digest = hashlib.sha256()
+        for file in MODEL_FILES.values():
+            stat = os.stat(os.path.join(self.model_dir, file))
+            digest.update(f'{file}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return digest.hexdigest()
+
+    # Predict all heads, vectorizing the product names once per distinct feature extraction
+    def predict_all(self, X, heads=None):
+        heads = heads or self.heads()
+        if len(X) == 0:
+            return {head: [] for head in heads}
+        features = {}
+        predictions = {}
+        for head in heads:
+            featurizer, estimator, key = self.get_split(head)
+            if featurizer is None:
+                predictions[head] = estimator.predict(X)
+                continue
+            if key not in features:
+                features[key] = featurizer.transform(X)
+            predictions[head] = estimator.predict(features[key])
+        return predictions
+
+    def heads(self):
+        return list(MODEL_FILES)
+
+
+# Registry of the current classification worker process and the model version it was loaded for
+_worker_model_dir = None
+_worker_registry = None
+_worker_version = None
+
+def _init_worker(model_dir):
+    global _worker_model_dir
+    _worker_model_dir = model_dir
+
+# Classify in a worker, dropping its registry for a fresh one whenever the models have a new version
+def _classify_names(names, model_version=None):
+    global _worker_registry, _worker_version
+    if _worker_registry is None or model_version != _worker_version:
+        _worker_registry = ModelRegistry(_worker_model_dir)
+        _worker_version = model_version
+    return _worker_registry.predict_all(names)
+
+# Create a process pool whose workers each keep their own registry. Workers are spawned rather than
+# forked so they do not inherit the threads of the Streamlit server. The pool outlives model updates:
+# pass the models' version to classify_chunks and workers reload when it changes.
+def create_executor(model_dir='.', max_workers=None):
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=(model_dir,))
+
+# Classify DataFrame chunks across the pool and yield (chunk, predictions) in input order.
+# At most max_pending chunks are in flight, so memory stays bounded however long the input is.
+def classify_chunks(chunks, executor, max_pending, text_column='ProductNew', model_version=None):
+    pending = deque()
+    for chunk in chunks:
+        pending.append((chunk, executor.submit(_classify_names, chunk[text_column].tolist(), model_version)))
+        if len(pending) >= max_pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+    while pending:
+        chunk, future = pending.popleft()
+        yield chunk, future.result()
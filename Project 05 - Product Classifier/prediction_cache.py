@@ -0,0 +1,68 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+# Normalize an EAN the way the classifier exports it: no thousands separators, no trailing .0
+def normalize_ean(ean):
+    ean = str(ean).replace(',', '').strip()
+    return ean[:-2] if ean.endswith('.0') else ean
+
+def name_hash(name):
+    return hashlib.blake2b(str(name).encode('utf-8'), digest_size=16).hexdigest()
+
+# Persistent cache of classifier predictions keyed on EAN, product name and model version.
+# Entries of other model versions are purged on open and the least recently used entries are
+# evicted once the cache holds more than max_entries products.
+class PredictionCache:
+    def __init__(self, path, model_version, heads, max_entries=1000000):
+        self.model_version = model_version
+        self.heads = list(heads)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS predictions (
+                ean TEXT, name_hash TEXT, model_version TEXT, predictions TEXT, last_used REAL,
+                PRIMARY KEY (ean, name_hash, model_version))''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)')
+            self._conn.execute('CREATE TEMP TABLE lookup_keys (position INTEGER, ean TEXT, name_hash TEXT)')
+            self._conn.execute('DELETE FROM predictions WHERE model_version != ?', (model_version,))
+
+    def _keys(self, chunk, ean_column, text_column):
+        return [(normalize_ean(ean), name_hash(name)) for ean, name in zip(chunk[ean_column], chunk[text_column])]
+
+    # Return the rows of chunk that are cached, with their predictions filled in
+    def lookup(self, chunk, ean_column='EAN', text_column='ProductNew'):
+        keys = self._keys(chunk, ean_column, text_column)
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM lookup_keys')
+            self._conn.executemany('INSERT INTO lookup_keys VALUES (?, ?, ?)',
+                                   [(position, ean, hashed) for position, (ean, hashed) in enumerate(keys)])
+            rows = self._conn.execute('''SELECT k.position, p.predictions FROM lookup_keys k
+                JOIN predictions p ON p.ean = k.ean AND p.name_hash = k.name_hash AND p.model_version = ?
+                ORDER BY k.position''', (self.model_version,)).fetchall()
+            self._conn.execute('''UPDATE predictions SET last_used = ? WHERE model_version = ?
+                AND (ean, name_hash) IN (SELECT ean, name_hash FROM lookup_keys)''', (time.time(), self.model_version))
+
+        hits = chunk.iloc[[position for position, _ in rows]].copy()
+        values = [json.loads(predictions) for _, predictions in rows]
+        for i, head in enumerate(self.heads):
+            hits[head] = [value[i] for value in values]
+        return hits
+
+    # Store the predictions of classified rows and evict the least recently used entries over the limit
+    def store(self, chunk, ean_column='EAN', text_column='ProductNew'):
+        if chunk.empty:
+            return
+        keys = self._keys(chunk, ean_column, text_column)
+        predictions = zip(*(chunk[head].tolist() for head in self.heads))
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?, ?)',
+                                   [(ean, hashed, self.model_version, json.dumps(list(values), default=str), now)
+                                    for (ean, hashed), values in zip(keys, predictions)])
+            excess = self._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0] - self.max_entries
+            if excess > 0:
+                self._conn.execute('DELETE FROM predictions WHERE rowid IN (SELECT rowid FROM predictions ORDER BY last_used LIMIT ?)', (excess,))
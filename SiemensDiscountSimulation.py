@@ -1,7 +1,21 @@
 import streamlit as st
-from datetime import datetime
-import time
-import random
+import pandas as pd
+import os
+import sys
+import hashlib
+
+# Scoring is shared with the Predictive Pricing pipeline
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Project 04 - Predictive Pricing'))
+import pricing_model
+
+# Trained model artifact written by the Predictive Pricing pipeline
+MODEL_PATH = os.environ.get('DISCOUNT_MODEL_PATH', os.path.join('models', 'discount_model_latest.joblib'))
+
+# Load the model once per process and share it across sessions
+@st.cache_resource
+def load_model_artifact(path, mtime):
+    # mtime is part of the cache key so a retrained model replaces the cached one
+    return pricing_model.load_model_artifact(path)
 
 # Custom CSS for gradient background, title position, hiding top margin, Arial font, and default select box option
 st.markdown(
@@ -69,26 +83,77 @@ Enter your parameters below and click on "Calculate Optimal Discount" to see the
 If you are not sure what to input, hover over the little help buttons next to each field to see an explanation.
 """)
 
+# Show the placeholder and whole-number ids nicely in the select boxes
+def format_option(x):
+    if x == "":
+        return 'Choose an option'
+    if isinstance(x, float) and x.is_integer():
+        return str(int(x))
+    return str(x)
+
+if not os.path.exists(MODEL_PATH):
+    st.error(f"No trained model found at {MODEL_PATH}. Run the Predictive Pricing pipeline first or set DISCOUNT_MODEL_PATH.")
+    st.stop()
+artifact = load_model_artifact(MODEL_PATH, os.path.getmtime(MODEL_PATH))
+options = artifact['options']
+
 # Form for input parameters
 with st.form(key='predict_form'):
-    sales_district = st.selectbox("Sales District", options=[""] + ["Europe", "Central America", "Southeast Asia", "Eastern Africa", "Western Australia"], index=0, format_func=lambda x: 'Choose an option' if x == "" else x, help="Select the Sales District from the list")
-    customer_name = st.selectbox("Customer Name", options=[""] + ["České dráhy, a.s.", "ČEZ a.s.", "ČKD Group", "Letiště Praha, a.s.", "Škoda Auto a.s."], index=0, format_func=lambda x: 'Choose an option' if x == "" else x, help="Select the Customer Name from the list")
-    product_category = st.selectbox("Product Category", options=[""] + ["Energy", "Industrial Automation", "Mobility", "Digital Industries"], index=0, format_func=lambda x: 'Choose an option' if x == "" else x, help="Select the Product Category from the list")
-    product_sub_category = st.selectbox("Product Sub-Category", options=[""] + ["Robotics", "Motion Control", "Industrial Ethernet"], index=0, format_func=lambda x: 'Choose an option' if x == "" else x, help="Select the Product Sub-Category from the list")
-    item_name = st.selectbox("Item Name", options=[""] + ["Assembly Line", "Solar Power System", "Electric Vehicle Charging Station"], index=0, format_func=lambda x: 'Choose an option' if x == "" else x, help="Select the Item Name from the list")
+    sales_district = st.selectbox("Sales District", options=[""] + options['SalesDistrictId'], index=0, format_func=format_option, help="Select the Sales District from the list")
+    customer_branch = st.selectbox("Customer Branch", options=[""] + options['CustomerBranch'], index=0, format_func=format_option, help="Select the industry branch of the customer")
+    customer_importance = st.selectbox("Customer Importance", options=[""] + options['Importance'], index=0, format_func=format_option, help="Select the importance class of the customer")
+    bisnode_score = st.selectbox("Bisnode Score", options=[""] + options['BisnodeScore'], index=0, format_func=format_option, help="Select the credit risk score of the customer")
+    product = st.selectbox("Product", options=[""] + options['PckBusinessTreeId'], index=0, format_func=format_option, help="Select the product node from the business tree")
+    item_price = st.number_input("Item List Price (EUR)", min_value=0.0, value=0.0, step=100.0, key='item_price', help="Enter the list price of a single item")
     item_count = st.number_input("Item Count", min_value=0, value=0, format='%d', step=1, key='item_count', help="Enter the total number of items in the order")
     
     # Calculate Optimal Discount button
     predict_button = st.form_submit_button(label='Calculate Optimal Discount')
 
-# Mimic processing after hitting the button
+# Score the inputs with the trained model
 if predict_button:
-    with st.spinner('Calculating...'):
-        time.sleep(2)  # Simulate a short processing time
-    item_price = random.uniform(500, 10000)
-    optimal_discount = random.uniform(30, 80)
-    discounted_price = item_price * (1 - optimal_discount / 100)
+    inputs = {
+        'SalesDistrictId': sales_district,
+        'CustomerBranch': customer_branch,
+        'Importance': customer_importance,
+        'BisnodeScore': bisnode_score,
+        'PckBusinessTreeId': product,
+        'ItemLPriceLocalCurrency': item_price,
+        'ItemCount': item_count
+    }
+    inputs = {col: value for col, value in inputs.items() if value != ""}
+    scored = pricing_model.score_batch(artifact, pd.DataFrame([inputs])).iloc[0]
+    optimal_discount = float(scored['OptimalDiscount'])
+    discounted_price = float(scored['DiscountedPrice'])
     
     st.write(f"### Item Price (EUR): {item_price:.2f}")
     st.write(f"### Optimal Discount: {optimal_discount:.2f}%")
     st.write(f"### Discounted Price (EUR): {discounted_price:.2f}")
+    st.caption(f"Model version {artifact['version']}")
+
+# Batch pricing of whole quotes and price lists
+st.markdown('<div class="subtitle">Batch Pricing</div>', unsafe_allow_html=True)
+batch_file = st.file_uploader("Upload a quote or price list", type=["csv", "xlsx"], help="One line item per row, with columns named like the model features, e.g. " + ", ".join(artifact['features']) + ". Missing columns are filled with typical values.")
+
+if batch_file is not None:
+    # Score only when a different file or model comes in; reruns reuse the stored result
+    priced = st.session_state.get('priced')
+    if priced is None or priced['file_id'] != batch_file.file_id or priced['model_version'] != artifact['version']:
+        upload_hash = hashlib.sha256(batch_file.getvalue()).hexdigest()
+        if priced is None or priced['upload_hash'] != upload_hash or priced['model_version'] != artifact['version']:
+            if batch_file.name.endswith('.xlsx'):
+                items = pd.read_excel(batch_file)
+            else:
+                items = pd.read_csv(batch_file)
+            items = pricing_model.score_batch(artifact, items)
+            priced = {'upload_hash': upload_hash, 'model_version': artifact['version'], 'items': items,
+                      'csv': items.to_csv(index=False).encode('utf-8')}
+        priced['file_id'] = batch_file.file_id
+        st.session_state['priced'] = priced
+    items = priced['items']
+
+    st.write(f"### Priced {len(items)} line items")
+    st.dataframe(items)
+    st.download_button(label="Download Priced Items",
+                       data=priced['csv'],
+                       file_name='Priced_Items.csv')